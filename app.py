@@ -1,8 +1,9 @@
-import os, re, csv, sqlite3, io
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template_string, send_file
+import os, csv, sqlite3, io, threading, shutil, tempfile, time, functools, queue, contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify
 from minio import Minio
 from minio.error import S3Error
+import urllib3
 
 # --- Flask App ---
 app = Flask(__name__)
@@ -11,14 +12,26 @@ app.config["MAX_CONTENT_LENGTH"] = 5 * 1024 * 1024  # 5 MB
 # --- SQLite Config ---
 DB_PATH = os.environ.get("DB_PATH", "./data/app.db")
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+SQLITE_BUSY_TIMEOUT = 30  # seconds an import waits for the writer lock
+SQLITE_LOCK_POLL = 0.05  # seconds
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "16"))
 
 # --- MinIO Config ---
 MINIO_ENDPOINT = os.environ.get("MINIO_ENDPOINT", "http://localhost:9000")
 MINIO_ACCESS_KEY = os.environ.get("MINIO_ACCESS_KEY", "miniokey")
 MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY", "miniosecret")
+MINIO_POOL_SIZE = int(os.environ.get("MINIO_POOL_SIZE", "64"))
 
-# --- Email Regex ---
-EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+# --- Email Validation ---
+def _email_ok(e):
+    # Same shape as ^[^@\s]+@[^@\s]+\.[^@\s]+$ using C-level string ops instead of the regex engine:
+    # one '@' with a non-empty local part, a '.' strictly inside the domain, and no whitespace.
+    at = e.find("@")
+    if at < 1 or e.find("@", at + 1) != -1:
+        return False
+    if "." not in e[at + 2:-1]:
+        return False
+    return e.split(None, 1) == [e]
 
 # --- HTML Template ---
 HTML = """
@@ -62,65 +75,198 @@ HTML = """
   </table>
 </div>
 """
+# Compiled once; render_template_string would re-parse HTML on every request.
+TEMPLATE = app.jinja_env.from_string(HTML)
 
 # --- DB Helper ---
-def db():
+# Per-connection tuning; journal_mode=WAL is persistent in the DB file and set once in init_db().
+PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+)
+
+_pool = queue.LifoQueue(maxsize=SQLITE_POOL_SIZE)
+
+def init_db():
     con = sqlite3.connect(DB_PATH)
-    con.execute("""CREATE TABLE IF NOT EXISTS customers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL UNIQUE,
-        age INTEGER NOT NULL,
-        created_at TEXT NOT NULL
-    )""")
+    try:
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("""CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            age INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )""")
+        con.commit()
+    finally:
+        con.close()
+
+def _open_con():
+    # Autocommit mode: writers open their own transactions with begin_immediate().
+    # The busy timeout is kept short because SQLite's busy handler blocks in C.
+    con = sqlite3.connect(DB_PATH, timeout=SQLITE_LOCK_POLL, isolation_level=None, check_same_thread=False)
+    for pragma in PRAGMAS:
+        con.execute(pragma)
     return con
 
+@contextlib.contextmanager
+def get_con():
+    # Process-wide pool checked out per use: the dev server starts a thread per request
+    # (and gevent a greenlet), so a per-thread cache would never be reused.
+    try:
+        con = _pool.get_nowait()
+    except queue.Empty:
+        con = _open_con()
+    try:
+        yield con
+    finally:
+        if con.in_transaction:
+            con.rollback()
+        try:
+            _pool.put_nowait(con)
+        except queue.Full:
+            con.close()
+
+def begin_immediate(con):
+    # Wait for the writer lock in Python rather than in SQLite's busy handler: time.sleep
+    # yields under gevent, so a worker's other greenlets keep running while an import in
+    # another process holds the lock.
+    deadline = time.monotonic() + SQLITE_BUSY_TIMEOUT
+    while True:
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if e.sqlite_errorcode & 0xff != sqlite3.SQLITE_BUSY or time.monotonic() >= deadline:
+                raise
+        time.sleep(SQLITE_LOCK_POLL)
+
+init_db()
+
 # --- CSV Import Function ---
+BATCH_SIZE = 500
+INSERT_SQL = "INSERT OR IGNORE INTO customers(name,email,age,created_at) VALUES "
+INSERT_ROW = "(?,?,?,?)"
+
+@functools.lru_cache(maxsize=None)
+def _insert_sql(n):
+    # One multi-row INSERT per chunk: SQLite prepares a single statement and binds all values.
+    # RETURNING reports only the rows INSERT OR IGNORE actually wrote.
+    return INSERT_SQL + ",".join([INSERT_ROW] * n) + " RETURNING email"
+
+def _flush_batch(con, batch, errors, ts):
+    """Insert a batch of validated (row, name, email, age) entries; returns rows inserted."""
+    values = []
+    for _, name, email, age in batch:
+        values += (name, email, age, ts)
+    # Stay under the bound-parameter limit (999 on older SQLite builds).
+    step = min(BATCH_SIZE, con.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER) // 4) * 4
+    inserted = set()
+    for k in range(0, len(values), step):
+        chunk = values[k:k + step]
+        inserted.update(r[0] for r in con.execute(_insert_sql(len(chunk) // 4), chunk))
+    # Duplicates are the rows missing from RETURNING; the first row with a given email is
+    # the one that was written, any later row in the batch was ignored.
+    ok = 0
+    for i, _, email, _ in batch:
+        if email in inserted:
+            inserted.discard(email)
+            ok += 1
+        else:
+            errors.append({"row": i, "msg": "duplicate email (already imported)"})
+    return ok
+
 def import_csv_stream(text_stream):
-    reader = csv.DictReader(text_stream)
+    reader = csv.reader(text_stream)
+    header = [c.strip().lower() for c in next(reader, None) or []]
     required = {"name", "email", "age"}
-    if not required.issubset(set([c.strip().lower() for c in reader.fieldnames or []])):
+    if not required.issubset(set(header)):
         raise ValueError("Header must include: name,email,age")
+    # Plain lists with fixed column indices avoid building a dict per row.
+    ni, ei, ai = header.index("name"), header.index("email"), header.index("age")
+    width = max(ni, ei, ai) + 1
 
     errors = []
     ok = 0
-    with db() as con:
-        for i, row in enumerate(reader, start=2):
-            name = (row.get("name") or "").strip()
-            email = (row.get("email") or "").strip().lower()
-            age_s = (row.get("age") or "").strip()
-
-            if len(name) < 2:
-                errors.append({"row": i, "msg": "name must be at least 2 characters"})
-                continue
-            if not EMAIL_RE.match(email):
-                errors.append({"row": i, "msg": "invalid email"})
-                continue
-            try:
-                age = int(age_s)
-                if age < 1 or age > 120:
-                    raise ValueError
-            except Exception:
-                errors.append({"row": i, "msg": "age must be an integer 1–120"})
-                continue
-
-            try:
-                con.execute("INSERT INTO customers(name,email,age,created_at) VALUES(?,?,?,?)",
-                            (name, email, age, datetime.utcnow().isoformat(timespec="seconds")+"Z"))
-                ok += 1
-            except sqlite3.IntegrityError:
-                errors.append({"row": i, "msg": "duplicate email (already imported)"})
-        con.commit()
+    batch = []
+    # created_at is second-precision, so one timestamp serves the whole import.
+    now_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    # Local aliases keep attribute lookups out of the per-row loop.
+    email_ok = _email_ok
+    append_err = errors.append
+    with get_con() as con:
+        begin_immediate(con)
+        try:
+            for i, row in enumerate(filter(None, reader), start=2):
+                if len(row) < width:
+                    row += [""] * (width - len(row))
+                name = row[ni].strip()
+                email = row[ei].strip().lower()
+                age_s = row[ai].strip()
+
+                if len(name) < 2:
+                    append_err({"row": i, "msg": "name must be at least 2 characters"})
+                    continue
+                if not email_ok(email):
+                    append_err({"row": i, "msg": "invalid email"})
+                    continue
+                try:
+                    age = int(age_s)
+                    if age < 1 or age > 120:
+                        raise ValueError
+                except Exception:
+                    append_err({"row": i, "msg": "age must be an integer 1–120"})
+                    continue
+
+                batch.append((i, name, email, age))
+                if len(batch) >= BATCH_SIZE:
+                    ok += _flush_batch(con, batch, errors, now_iso)
+                    batch = []
+            if batch:
+                ok += _flush_batch(con, batch, errors, now_iso)
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+    if ok:
+        invalidate_latest_rows()
+    errors.sort(key=lambda e: e["row"])
     return ok, errors
 
+SPOOL_MAX_SIZE = 1024 * 1024  # 1 MB
+
+def spool_stream(src):
+    """Copy a byte stream into a rewound SpooledTemporaryFile; returns (spool, length)."""
+    # import_csv_stream holds the SQLite write lock while it reads, so network sources
+    # (request bodies, MinIO objects) are spooled in full first (on disk past SPOOL_MAX_SIZE).
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    shutil.copyfileobj(src, spool)
+    length = spool.tell()
+    spool.seek(0)
+    return spool, length
+
 # --- Validate MinIO Connection ---
+def minio_http_client():
+    # Shared keep-alive pool sized for concurrent background uploads and webhook fetches;
+    # the Minio default (maxsize=10) makes bursts queue for a connection.
+    return urllib3.PoolManager(
+        num_pools=10,
+        maxsize=MINIO_POOL_SIZE,
+        timeout=urllib3.Timeout(connect=10, read=300),
+        retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    )
+
 def validate_minio_connection():
     endpoint = MINIO_ENDPOINT.replace("http://", "").replace("https://", "")
     try:
         mc = Minio(endpoint,
                    access_key=MINIO_ACCESS_KEY,
                    secret_key=MINIO_SECRET_KEY,
-                   secure=False)
+                   secure=False,
+                   http_client=minio_http_client())
         print(f"[DEBUG] Attempting to connect to MinIO at {MINIO_ENDPOINT}...")
         buckets = list(mc.list_buckets())
         print(f"[SUCCESS] MinIO connection established. Buckets: {[b.name for b in buckets]}")
@@ -131,29 +277,104 @@ def validate_minio_connection():
         print(f"[ERROR] Could not connect to MinIO: {e}")
     return None
 
+# --- Background MinIO Upload ---
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
+UPLOAD_BUCKET = "uploads"
+
+_bucket_ready = False
+_bucket_lock = threading.Lock()
+
+def ensure_bucket():
+    # The bucket effectively never disappears, so only check (and create) it once per process.
+    global _bucket_ready
+    if _bucket_ready:
+        return
+    with _bucket_lock:
+        if _bucket_ready:
+            return
+        if not minio_client.bucket_exists(UPLOAD_BUCKET):
+            print(f"[DEBUG] Bucket '{UPLOAD_BUCKET}' does not exist. Creating...")
+            minio_client.make_bucket(UPLOAD_BUCKET)
+        _bucket_ready = True
+
+def _upload_to_minio(fileobj, length, filename):
+    try:
+        bucket = UPLOAD_BUCKET
+        ensure_bucket()
+        ts = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        obj_name = f"{ts}_{os.path.basename(filename)}"
+        print(f"[DEBUG] Uploading '{obj_name}' ({length} bytes) to bucket '{bucket}'")
+        minio_client.put_object(bucket, obj_name, fileobj, length=length, content_type="text/csv")
+        print(f"[SUCCESS] Uploaded file to MinIO: {obj_name}")
+    except Exception as e:
+        print(f"[ERROR] Failed to upload to MinIO: {e}")
+    finally:
+        fileobj.close()
+
 # --- Web Routes ---
+EXPORT_CHUNK_ROWS = 500
+# id is an INTEGER PRIMARY KEY (rowid alias), so this is a reverse rowid scan that stops
+# after 50 rows; EXPLAIN QUERY PLAN shows no temp B-tree. A separate index on id would
+# only add write cost to imports.
+LATEST_SQL = "SELECT id,name,email,age,created_at FROM customers ORDER BY id DESC LIMIT 50"
+LATEST_TTL = 2.0  # seconds
+
+_latest_cache = (0.0, None)
+
+def latest_rows():
+    # The home page is read-hot; serve the top 50 from a short-lived cache.
+    global _latest_cache
+    cached_at, rows = _latest_cache
+    now = time.monotonic()
+    if rows is None or now - cached_at > LATEST_TTL:
+        with get_con() as con:
+            rows = con.execute(LATEST_SQL).fetchall()
+        _latest_cache = (now, rows)
+    return rows
+
+def invalidate_latest_rows():
+    global _latest_cache
+    _latest_cache = (0.0, None)
+
 @app.get("/")
 def home():
-    with db() as con:
-        rows = con.execute("SELECT id,name,email,age,created_at FROM customers ORDER BY id DESC LIMIT 50").fetchall()
-    return render_template_string(HTML, rows=rows, summary=None, errors=None)
+    return TEMPLATE.render(rows=latest_rows(), summary=None, errors=None)
+
+SAMPLE_BYTES = b"name,email,age\nAlice,alice@example.com,30\nBob,bob@example.org,25\n"
+SAMPLE_HEADERS = {
+    "Content-Disposition": "attachment; filename=sample_customers.csv",
+    "Content-Length": str(len(SAMPLE_BYTES)),
+}
 
 @app.get("/sample")
 def sample():
-    csv_bytes = b"name,email,age\nAlice,alice@example.com,30\nBob,bob@example.org,25\n"
-    return send_file(io.BytesIO(csv_bytes), mimetype="text/csv", as_attachment=True, download_name="sample_customers.csv")
+    return Response(SAMPLE_BYTES, mimetype="text/csv", headers=SAMPLE_HEADERS)
 
 @app.get("/export")
 def export():
-    with db() as con:
-        rows = con.execute("SELECT name,email,age,created_at FROM customers ORDER BY id").fetchall()
-    sio = io.StringIO()
-    w = csv.writer(sio)
-    w.writerow(["name","email","age","created_at"])
-    for r in rows:
-        w.writerow(r)
-    return send_file(io.BytesIO(sio.getvalue().encode("utf-8")), mimetype="text/csv",
-                     as_attachment=True, download_name="customers_export.csv")
+    def gen():
+        # Dedicated connection, not one from get_con(): the generator runs after the view
+        # returns and keeps a read snapshot open for the whole streamed response, which
+        # would hold a pooled connection checked out for as long as the client takes.
+        con = sqlite3.connect(DB_PATH)
+        try:
+            cur = con.execute("SELECT name,email,age,created_at FROM customers ORDER BY id")
+            sio = io.StringIO()
+            w = csv.writer(sio)
+            w.writerow(["name","email","age","created_at"])
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                w.writerows(rows)
+                yield sio.getvalue()
+                sio.seek(0)
+                sio.truncate()
+            yield sio.getvalue()
+        finally:
+            con.close()
+    return Response(gen(), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=customers_export.csv"})
 
 @app.post("/upload")
 def upload():
@@ -163,42 +384,57 @@ def upload():
     if not f.filename.lower().endswith(".csv"):
         return "Please upload a .csv file", 400
 
-    data = f.read()
-    wrapper = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", newline="")
+    # The spool is parsed in place and then handed to the background MinIO upload,
+    # which outlives the request's own stream.
+    spool, length = spool_stream(f.stream)
+    wrapper = io.TextIOWrapper(spool, encoding="utf-8", newline="")
     try:
         ok, errors = import_csv_stream(wrapper)
     except ValueError as e:
+        spool.close()
         return str(e), 400
+    wrapper.detach()
+    spool.seek(0)
 
-    # Upload to MinIO
-    try:
-        bucket = "uploads"
-        if not minio_client.bucket_exists(bucket):
-            print(f"[DEBUG] Bucket '{bucket}' does not exist. Creating...")
-            minio_client.make_bucket(bucket)
-        ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-        obj_name = f"{ts}_{os.path.basename(f.filename)}"
-        print(f"[DEBUG] Uploading '{obj_name}' ({len(data)} bytes) to bucket '{bucket}'")
-        minio_client.put_object(bucket, obj_name, io.BytesIO(data), length=len(data), content_type="text/csv")
-        print(f"[SUCCESS] Uploaded file to MinIO: {obj_name}")
-    except Exception as e:
-        print(f"[ERROR] Failed to upload to MinIO: {e}")
+    # Upload to MinIO in the background so the response doesn't wait on the PUT
+    EXECUTOR.submit(_upload_to_minio, spool, length, f.filename)
 
-    with db() as con:
-        rows = con.execute("SELECT id,name,email,age,created_at FROM customers ORDER BY id DESC LIMIT 50").fetchall()
-    return render_template_string(HTML, rows=rows, summary={"ok": ok, "err": len(errors)}, errors=errors)
+    # Query directly rather than through latest_rows(): a concurrent refill of the cache
+    # could store a snapshot taken before this import committed.
+    with get_con() as con:
+        rows = con.execute(LATEST_SQL).fetchall()
+    return TEMPLATE.render(rows=rows, summary={"ok": ok, "err": len(errors)}, errors=errors)
 
 @app.get("/health")
 def health():
     return "OK", 200
 
 # --- MinIO Webhook Endpoint ---
+OBS_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+def _process_record(bucket, obj):
+    try:
+        print(f"[OBS EVENT] Downloading '{obj}' from bucket '{bucket}'")
+        # Spool the object before importing: the import holds the SQLite write lock, so
+        # downloading first lets GETs for the other records in the event overlap.
+        resp = minio_client.get_object(bucket, obj)
+        try:
+            spool, _ = spool_stream(resp)
+        finally:
+            resp.close(); resp.release_conn()
+        with spool:
+            ok, errors = import_csv_stream(io.TextIOWrapper(spool, encoding="utf-8", newline=""))
+        print(f"[OBS EVENT] Imported {ok} rows, errors {len(errors)} from {bucket}/{obj}")
+        return {"bucket": bucket, "object": obj, "inserted": ok, "errors": len(errors)}
+    except Exception as e:
+        print(f"[OBS EVENT] Error for {bucket}/{obj}: {e}")
+        return {"bucket": bucket, "object": obj, "error": str(e)}
+
 @app.post("/obs-event")
 def obs_event():
     payload = request.get_json(force=True, silent=True) or {}
     records = payload.get("Records") or []
-    total_ok, total_err = 0, 0
-    details = []
+    items = []
 
     for rec in records:
         bucket = (((rec.get("s3") or {}).get("bucket") or {}).get("name")) or ""
@@ -206,23 +442,13 @@ def obs_event():
         if not bucket or not obj:
             continue
         if not obj.lower().endswith(".csv"):
-            details.append({"bucket": bucket, "object": obj, "skipped": "not a .csv"})
+            items.append({"bucket": bucket, "object": obj, "skipped": "not a .csv"})
             continue
+        items.append(OBS_EXECUTOR.submit(_process_record, bucket, obj))
 
-        try:
-            print(f"[OBS EVENT] Downloading '{obj}' from bucket '{bucket}'")
-            resp = minio_client.get_object(bucket, obj)
-            data = resp.read(); resp.close(); resp.release_conn()
-            wrapper = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", newline="")
-            ok, errors = import_csv_stream(wrapper)
-            total_ok += ok
-            total_err += len(errors)
-            details.append({"bucket": bucket, "object": obj, "inserted": ok, "errors": len(errors)})
-            print(f"[OBS EVENT] Imported {ok} rows, errors {len(errors)} from {bucket}/{obj}")
-        except Exception as e:
-            details.append({"bucket": bucket, "object": obj, "error": str(e)})
-            print(f"[OBS EVENT] Error for {bucket}/{obj}: {e}")
-
+    details = [it.result() if isinstance(it, Future) else it for it in items]
+    total_ok = sum(d.get("inserted", 0) for d in details)
+    total_err = sum(d.get("errors", 0) for d in details)
     return jsonify({"ok": total_ok, "errors": total_err, "items": details}), 200
 
 # --- Main ---
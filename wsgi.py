@@ -0,0 +1,16 @@
+# --- Gunicorn Entry Point ---
+# gunicorn -k gevent -w 4 --worker-connections 1000 -b 0.0.0.0:8080 wsgi:app
+#
+# Patch before anything else imports socket/threading so MinIO I/O yields to other
+# requests. SQLite lock waits in app.py sleep via time.sleep, which gevent makes cooperative.
+from gevent import monkey
+monkey.patch_all()
+
+import app as csv_app
+
+csv_app.minio_client = csv_app.validate_minio_connection()
+if not csv_app.minio_client:
+    print("[FATAL] Cannot proceed. Check MinIO endpoint, keys, and network.")
+    exit(1)
+
+app = csv_app.app